@@ -3,15 +3,27 @@
 # - Initializes the FastAPI app.
 # - Configures CORS middleware to allow frontend access.
 # - Includes all the API endpoint routers.
+# - Runs uvicorn with uvloop and httptools when executed directly.
 #
+import os
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 
 # Import the router objects from their respective files
 from app.routers import upload, analyze, memo, modeling
+from app.services import cache, llm
+
+# --- Lifecycle ---
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Releases the pooled OpenAI connections when the server stops."""
+    yield
+    await llm.close_client()
 
 # --- App Initialization ---
 app = FastAPI(
+    lifespan=lifespan,
     title="Investment AI Agent",
     version="0.1.0",
     description="A backend service for an AI-powered investment analysis tool.",
@@ -47,5 +59,24 @@ app.include_router(modeling.router, prefix="/api", tags=["4. Financial Modeling"
 def health_check():
     """
     A simple endpoint to confirm that the API server is running and responsive.
+    Also reports the hit/miss counters of the shared analysis cache.
     """
-    return {"status": "ok", "version": "0.1.0"}
\ No newline at end of file
+    return {"status": "ok", "version": "0.1.0", "analysis_cache": cache.analysis_cache_stats()}
+
+# --- Server Entrypoint ---
+# `python -m app.main` serves the app with the uvloop event loop and the httptools
+# HTTP parser. It runs a single worker process by default: documents live in a local
+# chromadb.PersistentClient directory, which is thread-safe but not process-safe.
+# Raise WEB_CONCURRENCY only when ChromaDB runs as a server behind chromadb.HttpClient.
+if __name__ == "__main__":
+    import uvicorn
+
+    uvicorn.run(
+        "app.main:app",
+        host=os.getenv("HOST", "0.0.0.0"),
+        port=int(os.getenv("PORT", "8000")),
+        workers=int(os.getenv("WEB_CONCURRENCY", "1")),
+        loop="uvloop",
+        http="httptools",
+        log_level="warning",
+    )
@@ -39,4 +39,17 @@ class DCFResponse(BaseModel):
     bull: float
     bear: float
     yearly: List[DCFYearlyProjection]
-    assumptions_used: Dict[str, Any]
\ No newline at end of file
+    assumptions_used: Dict[str, Any]
+
+class DCFSensitivityRequest(DCFRequest):
+    simulations: int = Field(10_000, gt=0, le=100_000, description="Number of Monte Carlo scenarios to draw.")
+    growth_std: float = Field(0.05, ge=0, description="Std. deviation of the yearly growth-rate shocks.")
+    margin_std: float = Field(0.02, ge=0, description="Std. deviation of the operating-margin shock.")
+    discount_rate_std: float = Field(0.01, ge=0, description="Std. deviation of the discount-rate shock.")
+    seed: Optional[int] = Field(None, description="Random seed for reproducible sweeps.")
+
+class DCFSensitivityResponse(BaseModel):
+    simulations: int
+    mean: float
+    std: float
+    percentiles: Dict[str, float]
\ No newline at end of file
@@ -4,20 +4,17 @@
 # - GET endpoint to retrieve a cached analysis result.
 #
 import os
-from typing import Optional, Dict
+from typing import Optional
 from fastapi import APIRouter, HTTPException, Body, Path
+from fastapi.concurrency import run_in_threadpool
 
 # Assuming these modules from other developers/files exist
-from app.services import llm, sharia, rag
-from app.routers import upload # To access DOC_REGISTRY
+from app.services import llm, sharia, rag, cache
 from pydantic import BaseModel, Field
 
 # --- Router Setup ---
 router = APIRouter()
 
-# --- In-Memory Cache for Analysis Results ---
-ANALYSIS_CACHE: Dict[str, Dict] = {}
-
 # --- Pydantic Models ---
 class AnalysisRequest(BaseModel):
     k: int = Field(12, gt=0, le=50, description="Number of text chunks to retrieve.")
@@ -59,7 +56,7 @@ Rules:
 
 
 @router.post("/api/analyze/{document_id}", status_code=200)
-def create_analysis(
+async def create_analysis(
     document_id: str = Path(..., description="The ID of the uploaded document."),
     request: Optional[AnalysisRequest] = Body(default=None)
 ):
@@ -69,25 +66,27 @@ def create_analysis(
     # Use default request model if the body is empty or not provided
     req_body = request if request is not None else AnalysisRequest()
         
-    # 1. Validate document exists in the registry from the upload router
-    if document_id not in upload.DOC_REGISTRY:
+    # 1. Validate document exists. Only fully ingested uploads carry their summary
+    # as ChromaDB collection metadata, which every worker shares. ChromaDB and the
+    # analysis cache block, so they are called from a worker thread.
+    if await run_in_threadpool(rag.get_document_info, document_id) is None:
         raise HTTPException(status_code=404, detail=f"Document with ID '{document_id}' not found.")
 
     try:
         # 2. Retrieve top-k chunks using the RAG service
         embed_func = llm.get_embedder()
         # Per requirements, an empty query_text is acceptable for MVP
-        top_chunks = rag.get_top_k(document_id, query_text="", k=req_body.k, embed_func=embed_func)
+        top_chunks = await rag.get_top_k(document_id, query_text="", k=req_body.k, embed_func=embed_func)
         
-        if not top_chunks:
+        if not top_chunks["ids"]:
             raise HTTPException(status_code=400, detail="Could not retrieve text chunks from the document.")
 
-        # 3. Call LLM for structured analysis
-        analysis_result = llm.strict_json_analyze(top_chunks, ANALYSIS_PROMPT, doc_id_for_demo=document_id)
+        # 3. Call LLM for structured analysis over the (cached) page-headed context
+        context = rag.build_context(document_id, top_chunks)
+        analysis_result = await llm.strict_json_analyze(context, ANALYSIS_PROMPT, doc_id_for_demo=document_id)
         
         # 4. Run Sharia screening on the raw texts and the LLM analysis
-        chunk_texts = [chunk.get('text', '') for chunk in top_chunks]
-        sharia_findings = sharia.screen_sharia(chunk_texts, analysis_result)
+        sharia_findings = sharia.screen_sharia(top_chunks["texts"], analysis_result)
         
         # 5. Add sharia_findings object to the final result
         analysis_result["sharia_findings"] = sharia_findings
@@ -98,7 +97,7 @@ def create_analysis(
             severity = severity_map.get(sharia_findings["status"], "Low")
             for reason in sharia_findings["reasons"]:
                 if "No explicit non-compliant" in reason: continue
-                analysis_result["red_flags"].append({
+                analysis_result.setdefault("red_flags", []).append({
                     "flag": reason,
                     "severity": severity,
                     "category": "Sharia",
@@ -106,7 +105,7 @@ def create_analysis(
                 })
         
         # 6. Cache and return the result
-        ANALYSIS_CACHE[document_id] = analysis_result
+        await run_in_threadpool(cache.set_analysis, document_id, analysis_result)
         return analysis_result
 
     except Exception as e:
@@ -120,7 +119,7 @@ def get_analysis(document_id: str = Path(..., description="The ID of the documen
     """
     Retrieves a cached analysis result for a given document ID.
     """
-    result = ANALYSIS_CACHE.get(document_id)
+    result = cache.get_analysis(document_id)
     if not result:
         raise HTTPException(
             status_code=404,
@@ -1,29 +1,38 @@
 #
 # memo.py: FastAPI router for generating investment memos.
 # - POST endpoint to generate a memo from a cached analysis.
+# - POST endpoint to generate memos for several documents concurrently.
+# - POST endpoint to stream a memo as Server-Sent Events while it is generated.
 #
 import os
-import json
+import asyncio
+import orjson
+from typing import Any, AsyncIterator, Dict, List, Optional
 from fastapi import APIRouter, HTTPException, Body
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel, Field
-from openai import OpenAI
 
-# Depends on the analysis cache from the analyze router
-from .analyze import ANALYSIS_CACHE 
+# Depends on the shared analysis cache written by the analyze router, and
+# memoizes generated memos in its LLM response cache. Cache calls block on
+# SQLite, so they run in a worker thread.
+from app.services import cache
+# Reuses the shared AsyncOpenAI client from the LLM service
+from app.services import llm
 
-# --- Router and Client Setup ---
+# --- Router Setup ---
 router = APIRouter()
 DEMO_MODE = os.getenv("DEMO_MODE", "false").lower() == "true"
 
-client = None
-if not DEMO_MODE:
-    client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-
 # --- Pydantic Models ---
 class MemoRequest(BaseModel):
     document_id: str = Field(..., description="The ID of the analyzed document.")
     language: str = Field("en", pattern="^(en|ar)$", description="Language of the memo ('en' or 'ar').")
 
+class MemoBatchRequest(BaseModel):
+    document_ids: List[str] = Field(..., min_length=1, description="The IDs of the analyzed documents.")
+    language: str = Field("en", pattern="^(en|ar)$", description="Language of the memos ('en' or 'ar').")
+
 # --- Prompt Definition ---
 MEMO_PROMPT = """
 You are writing a professional investment memo for an institutional investor.
@@ -48,6 +57,12 @@ Style:
 - Markdown only.
 """
 
+ARABIC_INSTRUCTION = """
+Language:
+- Write the entire memo in professional, formal Arabic suitable for financial documents.
+- Keep the Markdown formatting and section structure.
+"""
+
 CANNED_MEMO = """
 # EXECUTIVE SUMMARY
 Innovate Inc. presents a compelling investment case in the Enterprise SaaS sector, driven by strong 35% revenue growth to $50M ARR and high net revenue retention of 120%. The company's AI-powered workflow automation platform shows strong product-market fit. While promising, risks include high customer concentration (40% of revenue from one client) and emerging competition. We recommend a 'Consider' rating with a small initial position, pending further diligence on customer diversification and competitive moat.
@@ -76,53 +91,149 @@ A detailed valuation was not performed. Based on comparable public SaaS companie
 **Consider**. We recommend a small initial investment in Innovate Inc. The company's strong technology and impressive financial metrics are highly attractive. However, the identified risks, particularly customer concentration, warrant a cautious approach.
 """
 
+def _canned_memo(language: str) -> str:
+    if language == "ar":
+        return "(DEMO) Arabic translation unavailable offline.\n\n" + CANNED_MEMO
+    return CANNED_MEMO
+
+def _memo_messages(analysis: Dict[str, Any], language: str) -> List[Dict[str, str]]:
+    """
+    Builds the chat messages for one memo. Arabic memos are written directly in
+    Arabic in a single completion instead of a generate-then-translate round trip.
+    """
+    prompt = MEMO_PROMPT.format(analysis_json=orjson.dumps(analysis, option=orjson.OPT_INDENT_2).decode())
+    if language == "ar":
+        prompt += ARABIC_INSTRUCTION
+    return [
+        {"role": "system", "content": "You are a senior investment analyst writing in Markdown."},
+        {"role": "user", "content": prompt}
+    ]
+
+def _memo_key(messages: List[Dict[str, str]]) -> str:
+    """LLM cache key of a memo; identical analyses and languages reuse the stored memo."""
+    return cache.llm_key("gpt-4o-mini", *(message["content"] for message in messages))
+
+async def _write_memo(analysis: Dict[str, Any], language: str) -> str:
+    """Produces the complete Markdown memo for one analysis."""
+    if DEMO_MODE:
+        return _canned_memo(language)
+
+    messages = _memo_messages(analysis, language)
+    key = _memo_key(messages)
+    memo = await run_in_threadpool(cache.get_llm, key)
+    if memo is None:
+        async with llm.SEM_CHAT:
+            completion = await llm.client.chat.completions.create(
+                model="gpt-4o-mini",
+                messages=messages,
+                temperature=0.4
+            )
+        memo = completion.choices[0].message.content
+        await run_in_threadpool(cache.set_llm, key, memo)
+    return memo
+
+def _sse_event(data: str, event: Optional[str] = None) -> str:
+    """Formats one Server-Sent Event; multi-line data is split across 'data:' fields."""
+    lines = [f"event: {event}"] if event else []
+    lines.extend(f"data: {line}" for line in data.split("\n"))
+    return "\n".join(lines) + "\n\n"
+
+async def _stream_memo(analysis: Dict[str, Any], language: str) -> AsyncIterator[str]:
+    """Yields the memo as Server-Sent Events while the LLM is still generating it."""
+    if DEMO_MODE:
+        yield _sse_event(_canned_memo(language))
+        yield _sse_event("", event="done")
+        return
+
+    messages = _memo_messages(analysis, language)
+    key = _memo_key(messages)
+    memo = await run_in_threadpool(cache.get_llm, key)
+    if memo is not None:
+        yield _sse_event(memo)
+        yield _sse_event("", event="done")
+        return
+
+    parts: List[str] = []
+    try:
+        # The concurrency slot is held until the stream is fully consumed.
+        async with llm.SEM_CHAT:
+            stream = await llm.client.chat.completions.create(
+                model="gpt-4o-mini",
+                messages=messages,
+                temperature=0.4,
+                stream=True
+            )
+            async for chunk in stream:
+                delta = chunk.choices[0].delta.content if chunk.choices else None
+                if delta:
+                    parts.append(delta)
+                    yield _sse_event(delta)
+    except Exception as e:
+        # Headers are already sent, so errors are reported in-band.
+        yield _sse_event(f"Failed to generate memo: {e}", event="error")
+        return
+    # Only completed memos are memoized for later requests.
+    await run_in_threadpool(cache.set_llm, key, "".join(parts))
+    yield _sse_event("", event="done")
+
+
 @router.post("/api/memo/generate", response_model=str, responses={200: {"content": {"text/markdown": {}}}})
-def generate_memo(request: MemoRequest = Body(...)):
+async def generate_memo(request: MemoRequest = Body(...)):
     """
     Generates an investment memo based on a cached document analysis.
     """
     # 1. Check for cached analysis; raise 400 if not available
-    analysis = ANALYSIS_CACHE.get(request.document_id)
+    analysis = await run_in_threadpool(cache.get_analysis, request.document_id)
     if not analysis:
         raise HTTPException(
             status_code=400,
             detail="Analysis for this document_id not found. Please run analysis first."
         )
 
-    # 2. Handle Demo Mode (offline)
-    if DEMO_MODE:
-        memo_content = CANNED_MEMO
-        if request.language == "ar":
-            return "(DEMO) Arabic translation unavailable offline.\n\n" + memo_content
-        return memo_content
+    # 2. Generate the memo (canned in Demo Mode)
+    try:
+        return await _write_memo(analysis, request.language)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to generate memo: {e}")
 
-    # --- Real LLM Call ---
-    prompt = MEMO_PROMPT.format(analysis_json=json.dumps(analysis, indent=2))
+
+@router.post("/api/memo/generate/batch", response_model=Dict[str, str])
+async def generate_memos(request: MemoBatchRequest = Body(...)):
+    """
+    Generates memos for several analyzed documents concurrently.
+    Returns a mapping of document_id to Markdown memo.
+    """
+    analyses = await run_in_threadpool(
+        lambda: {doc_id: cache.get_analysis(doc_id) for doc_id in request.document_ids}
+    )
+    missing = [doc_id for doc_id, analysis in analyses.items() if not analysis]
+    if missing:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Analysis not found for document_id(s): {', '.join(missing)}. Please run analysis first."
+        )
+
+    # Repeated ids are generated once, since the analyses mapping is keyed by document_id.
     try:
-        completion = client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[
-                {"role": "system", "content": "You are a senior investment analyst writing in Markdown."},
-                {"role": "user", "content": prompt}
-            ],
-            temperature=0.4
+        memos = await asyncio.gather(
+            *[_write_memo(analysis, request.language) for analysis in analyses.values()]
         )
-        memo_content = completion.choices[0].message.content
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to generate memos: {e}")
+    return dict(zip(analyses, memos))
 
-        # Translate to Arabic if requested
-        if request.language == "ar":
-            translation_prompt = f"Translate the following investment memo into professional, formal Arabic. Preserve the Markdown formatting:\n\n{memo_content}"
-            translation_completion = client.chat.completions.create(
-                model="gpt-4o-mini",
-                messages=[
-                    {"role": "system", "content": "You are a professional translator specializing in financial documents."},
-                    {"role": "user", "content": translation_prompt}
-                ],
-                temperature=0.7
-            )
-            memo_content = translation_completion.choices[0].message.content
-        
-        return memo_content
 
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Failed to generate memo: {e}")
\ No newline at end of file
+
+@router.post("/api/memo/stream", responses={200: {"content": {"text/event-stream": {}}}})
+async def stream_memo(request: MemoRequest = Body(...)):
+    """
+    Streams an investment memo as Server-Sent Events, one event per generated
+    Markdown fragment, followed by a final 'done' event.
+    """
+    analysis = await run_in_threadpool(cache.get_analysis, request.document_id)
+    if not analysis:
+        raise HTTPException(
+            status_code=400,
+            detail="Analysis for this document_id not found. Please run analysis first."
+        )
+    return StreamingResponse(_stream_memo(analysis, request.language), media_type="text/event-stream")
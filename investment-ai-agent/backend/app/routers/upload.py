@@ -5,11 +5,11 @@
 # - Chunks the extracted text.
 # - Calls the RAG service to generate embeddings and store them in ChromaDB.
 #
-import io
-import uuid
+import hashlib
 import mimetypes
 from fastapi import APIRouter, UploadFile, File, HTTPException
-from typing import Dict, List, Any
+from fastapi.concurrency import run_in_threadpool
+from typing import Dict, List, Any, BinaryIO, Callable, Optional
 
 # Import the necessary services and schemas
 from app.services import parsing, rag, llm
@@ -17,42 +17,81 @@ from app.models.schemas import UploadResponse
 
 router = APIRouter()
 
-# In-memory registry of uploaded documents. For a hackathon, this is a simple
-# way to track what has been uploaded without a persistent database.
-# The 'analyze' endpoint will check this registry to validate a document_id.
-DOC_REGISTRY: Dict[str, Dict[str, Any]] = {}
+# Uploaded documents are tracked by ChromaDB itself: each document's collection
+# carries its upload summary as metadata (see rag.get_document_info), so every
+# worker sees the same registry without a per-process dict.
+
+PDF_MIME = 'application/pdf'
+DOCX_MIME = 'application/vnd.openxmlformats-officedocument.wordprocessingml.document'
+XLSX_MIME = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+
+PARSERS: Dict[str, Callable[[BinaryIO], List[Dict[str, Any]]]] = {
+    PDF_MIME: parsing.extract_text_from_pdf,
+    DOCX_MIME: parsing.extract_text_from_docx,
+    XLSX_MIME: parsing.extract_text_from_xlsx,
+}
+
+def _detect_mime_type(stream: BinaryIO, filename: Optional[str]) -> Optional[str]:
+    """
+    Sniffs the file's magic bytes: '%PDF' is a PDF, and a ZIP header is an Office
+    Open XML container, told apart as DOCX or XLSX by the filename extension.
+    Returns the filename-guessed type for anything else, which is then rejected.
+    """
+    head = stream.read(8)
+    stream.seek(0)
+    mime_type, _ = mimetypes.guess_type(filename or "")
+    if head.startswith(b"%PDF"):
+        return PDF_MIME
+    if head.startswith(b"PK\x03\x04") and mime_type in (DOCX_MIME, XLSX_MIME):
+        return mime_type
+    return None if mime_type in PARSERS else mime_type
+
+def _content_hash(stream: BinaryIO) -> str:
+    """
+    Hashes the file content in 1 MiB blocks. The digest is the document_id, so
+    uploading identical bytes again maps to the same ChromaDB collection.
+    """
+    digest = hashlib.sha256()
+    for block in iter(lambda: stream.read(1 << 20), b""):
+        digest.update(block)
+    stream.seek(0)
+    return digest.hexdigest()[:32]
 
 @router.post("/upload", response_model=UploadResponse)
 async def upload_document(file: UploadFile = File(...)):
     """
     Handles the upload of a document. This is the first step in the workflow.
     
-    1.  Generates a unique ID for the document.
-    2.  Reads the file content and determines its type.
+    1.  Derives the document ID from a hash of the file content; a document that
+        was already ingested is returned as-is, without parsing or embedding it again.
+    2.  Determines the file type from its leading bytes.
     3.  Calls the appropriate parsing function to extract text.
     4.  Splits the text into smaller, manageable chunks.
     5.  Creates a unique ChromaDB collection for the document.
     6.  Generates vector embeddings for each chunk and stores them in the collection.
     7.  Returns the unique document_id to the client for use in subsequent API calls.
     """
-    document_id = str(uuid.uuid4())
+    document_id = await run_in_threadpool(_content_hash, file.file)
     filename = file.filename
-    content = await file.read()
+
+    existing = await run_in_threadpool(rag.get_document_info, document_id)
+    if existing is not None:
+        return UploadResponse(
+            document_id=document_id, filename=filename, pages=existing["pages"], chunks=existing["chunks"]
+        )
     
-    # 1. Determine file type and select the correct parser
-    mime_type, _ = mimetypes.guess_type(filename)
+    # 1. Determine file type from its leading bytes and select the correct parser
+    mime_type = _detect_mime_type(file.file, filename)
+    parser = PARSERS.get(mime_type)
+    if parser is None:
+        # If the file type is not supported, return a clear error.
+        raise HTTPException(status_code=400, detail=f"Unsupported file type: {mime_type or 'unknown'}")
     
+    # The upload's spooled temporary file is parsed in place, off the event loop,
+    # instead of first being read into memory as one bytes object.
     pages_data: List[Dict] = []
     try:
-        if mime_type == 'application/pdf':
-            pages_data = parsing.extract_text_from_pdf(io.BytesIO(content))
-        elif mime_type == 'application/vnd.openxmlformats-officedocument.wordprocessingml.document':
-            pages_data = parsing.extract_text_from_docx(io.BytesIO(content))
-        elif mime_type == 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet':
-            pages_data = parsing.extract_text_from_xlsx(io.BytesIO(content))
-        else:
-            # If the file type is not supported, return a clear error.
-            raise HTTPException(status_code=400, detail=f"Unsupported file type: {mime_type or 'unknown'}")
+        pages_data = await run_in_threadpool(parser, file.file)
     except Exception as e:
         # Catch any errors during the parsing process.
         raise HTTPException(status_code=500, detail=f"Failed to parse document: {str(e)}")
@@ -79,11 +118,18 @@ async def upload_document(file: UploadFile = File(...)):
     if not all_chunks:
         raise HTTPException(status_code=400, detail="Could not extract any text from the document.")
 
+    # Near-duplicate chunks (repeated headers, footers, boilerplate) are embedded only once
+    keep = await run_in_threadpool(parsing.unique_chunk_indices, all_chunks)
+    if len(keep) < len(all_chunks):
+        all_chunks = [all_chunks[i] for i in keep]
+        all_metadatas = [all_metadatas[i] for i in keep]
+        all_ids = [all_ids[i] for i in keep]
+
     # 3. Get the embedding function (handles DEMO_MODE automatically)
     embed_func = llm.get_embedder()
     
     # 4. Create a new collection and store the chunks and their embeddings
-    rag.upsert_chunks(
+    await rag.upsert_chunks(
         collection_name=document_id,  # Use the unique doc ID as the collection name
         chunks=all_chunks,
         metadatas=all_metadatas,
@@ -91,8 +137,11 @@ async def upload_document(file: UploadFile = File(...)):
         embed_func=embed_func
     )
 
-    # 5. Register the document as successfully processed
-    DOC_REGISTRY[document_id] = {"filename": filename, "pages": len(pages_data), "chunks": len(all_chunks)}
+    # 5. Register the document as successfully processed. The summary is stored
+    # on the collection so re-uploads in any worker are recognized.
+    await run_in_threadpool(
+        rag.set_document_info, document_id, {"filename": filename or "", "pages": len(pages_data), "chunks": len(all_chunks)}
+    )
     
     return UploadResponse(
         document_id=document_id,
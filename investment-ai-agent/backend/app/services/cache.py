@@ -0,0 +1,60 @@
+#
+# cache.py: Shared cache for analysis results.
+# - Backed by diskcache (SQLite + files), so every uvicorn worker on the host
+#   reads and writes the same entries instead of a per-process dict.
+# - Entries expire after ANALYSIS_CACHE_TTL seconds and the store is size-bounded
+#   with least-recently-used eviction.
+# - Hit/miss statistics are recorded for monitoring.
+# - LLM completions are memoized in a second store, keyed by a hash of their inputs,
+#   so identical analysis and memo requests do not hit the API again.
+#
+import os
+import hashlib
+import diskcache
+from typing import Dict, Any, Optional
+
+# --- Cache Configuration ---
+ANALYSIS_CACHE_DIR = os.getenv("ANALYSIS_CACHE_DIR", "./cache/analysis")
+ANALYSIS_CACHE_TTL = int(os.getenv("ANALYSIS_CACHE_TTL", "3600"))
+
+_analysis_cache = diskcache.Cache(
+    ANALYSIS_CACHE_DIR,
+    size_limit=2**30,
+    eviction_policy="least-recently-used",
+    statistics=True,
+)
+
+def get_analysis(document_id: str) -> Optional[Dict[str, Any]]:
+    """Returns the cached analysis for a document, or None if absent or expired."""
+    return _analysis_cache.get(document_id)
+
+def set_analysis(document_id: str, analysis: Dict[str, Any]):
+    """Stores an analysis result for a document with the configured TTL."""
+    _analysis_cache.set(document_id, analysis, expire=ANALYSIS_CACHE_TTL)
+
+def analysis_cache_stats() -> Dict[str, int]:
+    """Returns the hit and miss counters of the analysis cache."""
+    hits, misses = _analysis_cache.stats()
+    return {"hits": hits, "misses": misses}
+
+# --- LLM Response Cache ---
+LLM_CACHE_DIR = os.getenv("LLM_CACHE_DIR", "./cache/llm")
+LLM_CACHE_TTL = int(os.getenv("LLM_CACHE_TTL", str(30 * 86400)))
+
+_llm_cache = diskcache.Cache(
+    LLM_CACHE_DIR,
+    size_limit=2**30,
+    eviction_policy="least-recently-used",
+)
+
+def llm_key(*parts: str) -> str:
+    """Builds a cache key from the model, prompt and inputs of an LLM call."""
+    return hashlib.sha256("||".join(parts).encode("utf-8")).hexdigest()
+
+def get_llm(key: str) -> Optional[Any]:
+    """Returns a memoized LLM result, or None if absent or expired."""
+    return _llm_cache.get(key)
+
+def set_llm(key: str, result: Any):
+    """Memoizes an LLM result with the configured TTL."""
+    _llm_cache.set(key, result, expire=LLM_CACHE_TTL)
@@ -2,23 +2,83 @@
 # llm.py: Interacts with Large Language Models for embedding and analysis.
 #
 import os
-import json
+import time
+import asyncio
 import hashlib
+import httpx
+import diskcache
+import orjson
 import numpy as np
-from openai import OpenAI, OpenAIError
-from fastapi import HTTPException # <--- FIX: Added this import
-from typing import List, Callable, Dict, Any
+from cachetools import TTLCache
+from fastapi.concurrency import run_in_threadpool
+from openai import AsyncOpenAI, OpenAIError
+from app.services import cache
+from typing import List, Callable, Awaitable, Dict, Any
 
 # --- Environment Configuration ---
 DEMO_MODE = os.getenv("DEMO_MODE", "false").lower() == "true"
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 
 # --- OpenAI Client Initialization ---
+# A single async client is shared by every router so that concurrent requests
+# are multiplexed over one keep-alive HTTP/2 connection pool on the event loop,
+# avoiding a TLS handshake per call. The pool is closed on app shutdown.
+# Pool sizes can be tuned per deployment alongside the concurrency limits below.
+OPENAI_MAX_CONNECTIONS = int(os.getenv("OPENAI_MAX_CONNECTIONS", "200"))
+OPENAI_MAX_KEEPALIVE = int(os.getenv("OPENAI_MAX_KEEPALIVE", "100"))
+OPENAI_TIMEOUT = float(os.getenv("OPENAI_TIMEOUT", "60"))
+
 client = None
+http_client = None
 if not DEMO_MODE:
     if not OPENAI_API_KEY:
         raise ValueError("OPENAI_API_KEY environment variable must be set when DEMO_MODE is false.")
-    client = OpenAI(api_key=OPENAI_API_KEY)
+    http_client = httpx.AsyncClient(
+        http2=True,
+        limits=httpx.Limits(max_connections=OPENAI_MAX_CONNECTIONS, max_keepalive_connections=OPENAI_MAX_KEEPALIVE),
+        timeout=OPENAI_TIMEOUT,
+    )
+    client = AsyncOpenAI(api_key=OPENAI_API_KEY, http_client=http_client)
+
+async def close_client():
+    """Closes the shared HTTP connection pool."""
+    if http_client is not None:
+        await http_client.aclose()
+
+# --- Rate Limiting ---
+# Concurrent OpenAI calls are capped per endpoint, and embedding requests are also
+# paced to the account's requests-per-minute limit, so bursts of concurrent
+# uploads and analyses queue locally instead of triggering 429 retries.
+OPENAI_CHAT_CONCURRENCY = int(os.getenv("OPENAI_CHAT_CONCURRENCY", "20"))
+OPENAI_EMBED_CONCURRENCY = int(os.getenv("OPENAI_EMBED_CONCURRENCY", "40"))
+OPENAI_EMBED_RPM = int(os.getenv("OPENAI_EMBED_RPM", "3000"))
+
+SEM_CHAT = asyncio.Semaphore(OPENAI_CHAT_CONCURRENCY)
+SEM_EMBED = asyncio.Semaphore(OPENAI_EMBED_CONCURRENCY)
+
+class RateLimiter:
+    """Token bucket that allows `per_minute` acquisitions per minute, bursting up to one second's worth."""
+
+    def __init__(self, per_minute: int):
+        self.rate = per_minute / 60.0
+        self.capacity = max(1.0, self.rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self):
+        # Waiters queue on the lock, so tokens are handed out in arrival order.
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+EMBED_LIMITER = RateLimiter(OPENAI_EMBED_RPM)
 
 # --- Canned Responses for Demo Mode ---
 CANNED_ANALYSIS_RESPONSE = {
@@ -31,62 +91,138 @@ CANNED_ANALYSIS_RESPONSE = {
     "competitive_position": "The company holds a strong position against its main competitor.",
     "citations": [{"page": 12, "quote": "Revenue for Fiscal Year 2024 reached $50 million..."}]
 }
-CANNED_MEMO_EN = "# EXECUTIVE SUMMARY (DEMO)\nInnovate Inc. shows strong potential..."
-CANNED_MEMO_AR = "(DEMO) Arabic translation unavailable offline.\n\n# EXECUTIVE SUMMARY (DEMO)\nInnovate Inc. shows strong potential..."
 
 # --- Embedding Service ---
-def _hash_embedder(texts: List[str], dim: int = 768) -> List[List[float]]:
-    embeddings = []
-    for text in texts:
-        hasher = hashlib.sha256(text.encode('utf-8'))
-        seed = int.from_bytes(hasher.digest()[:4], 'big')
-        rng = np.random.RandomState(seed)
-        vec = rng.rand(dim) - 0.5
-        norm = np.linalg.norm(vec)
-        embeddings.append((vec / norm).tolist() if norm > 0 else vec.tolist())
-    return embeddings
-
-def get_embedder() -> Callable[[List[str]], List[List[float]]]:
+# Embedders return a float32 (N, dim) matrix. float32 halves the footprint of
+# Python float lists and is handed to ChromaDB as-is.
+Embedder = Callable[[List[str]], Awaitable[np.ndarray]]
+
+EMBED_MODEL = "text-embedding-3-small"
+
+# Maximum number of texts sent in a single embeddings request. Smaller shards
+# spread a large upload over more concurrent requests (bounded by SEM_EMBED).
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "96"))
+
+# Chunk text never changes once uploaded, so embeddings are cached in-process,
+# keyed by the embedding model and the SHA-256 digest of the text. Entries expire after an hour.
+# The cache is bounded by the bytes of its vectors (64 MiB per worker by default).
+EMBED_CACHE_BYTES = int(os.getenv("EMBED_CACHE_BYTES", str(64 * 2**20)))
+EMBED_CACHE: TTLCache = TTLCache(maxsize=EMBED_CACHE_BYTES, ttl=3600, getsizeof=lambda vec: vec.nbytes)
+
+# Behind the in-process cache sits a content-addressed disk cache shared by all
+# workers and kept across restarts, so boilerplate chunks repeated across uploads
+# are embedded only once. Vectors are stored as raw float32 bytes. SQLite access
+# blocks, so each request's lookups and writes run as one batch in a worker thread.
+EMBED_CACHE_DIR = os.getenv("EMBED_CACHE_DIR", os.path.join(os.getenv("CHROMA_DIR", "./chroma"), "embcache"))
+EMBED_DISK_CACHE = diskcache.Cache(EMBED_CACHE_DIR, size_limit=2**30, eviction_policy="least-recently-used")
+
+def _disk_get_many(keys: List[bytes]) -> Dict[bytes, bytes]:
+    """Reads the stored vectors for the given keys from EMBED_DISK_CACHE in one transaction."""
+    found = {}
+    with EMBED_DISK_CACHE.transact():
+        for key in keys:
+            blob = EMBED_DISK_CACHE.get(key)
+            if blob is not None:
+                found[key] = blob
+    return found
+
+def _disk_set_many(items: Dict[bytes, bytes]):
+    """Writes vectors to EMBED_DISK_CACHE in one transaction."""
+    with EMBED_DISK_CACHE.transact():
+        for key, blob in items.items():
+            EMBED_DISK_CACHE.set(key, blob)
+
+def _with_cache(embed: Embedder, model: str) -> Embedder:
+    """
+    Wraps an embedder so only texts missing from EMBED_CACHE and EMBED_DISK_CACHE
+    are sent to it. Results are returned in the original input order.
+    """
+    prefix = model.encode('utf-8') + b":"
+    async def cached_embed(texts: List[str]) -> np.ndarray:
+        keys = [prefix + hashlib.sha256(text.encode('utf-8')).digest() for text in texts]
+        found: Dict[bytes, np.ndarray] = {}
+        missing: Dict[bytes, str] = {}
+        for key, text in zip(keys, texts):
+            if key in found or key in missing:
+                continue
+            vec = EMBED_CACHE.get(key)
+            if vec is not None:
+                found[key] = vec
+            else:
+                missing[key] = text
+        if missing:
+            for key, blob in (await run_in_threadpool(_disk_get_many, list(missing))).items():
+                vec = np.frombuffer(blob, dtype=np.float32)
+                EMBED_CACHE[key] = vec
+                found[key] = vec
+                del missing[key]
+        if missing:
+            vecs = await embed(list(missing.values()))
+            for key, vec in zip(missing, vecs):
+                # Rows are copied so a cached vector does not keep the whole batch matrix alive.
+                EMBED_CACHE[key] = vec.copy()
+                found[key] = vec
+            await run_in_threadpool(_disk_set_many, {key: vec.tobytes() for key, vec in zip(missing, vecs)})
+        if not keys:
+            return np.empty((0, 0), dtype=np.float32)
+        return np.stack([found[key] for key in keys])
+    return cached_embed
+
+def _hash_embed_matrix(texts: List[str], dim: int = 768) -> np.ndarray:
+    """
+    Deterministic offline embeddings: each text's SHAKE-256 digest is expanded to
+    `dim` bytes, reinterpreted as int8 and L2-normalized. Returns a float32 (N, dim) matrix.
+    """
+    digests = b"".join(hashlib.shake_256(text.encode('utf-8')).digest(dim) for text in texts)
+    vecs = np.frombuffer(digests, dtype=np.int8).reshape(len(texts), dim).astype(np.float32)
+    # Normalize the whole batch at once; guard against zero-norm rows.
+    norms = np.linalg.norm(vecs, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    vecs /= norms
+    return vecs
+
+def get_embedder() -> Embedder:
     if DEMO_MODE:
-        return _hash_embedder
+        # Hashing is cheaper than a cache lookup, so offline embeddings are never cached.
+        async def hash_embed(texts: List[str]) -> np.ndarray:
+            return _hash_embed_matrix(texts)
+        return hash_embed
     else:
-        def openai_embed(texts: List[str]) -> List[List[float]]:
-            if not texts: return []
+        async def embed_batch(batch: List[str]) -> np.ndarray:
+            await EMBED_LIMITER.acquire()
+            async with SEM_EMBED:
+                response = await client.embeddings.create(model=EMBED_MODEL, input=batch)
+            return np.asarray([embedding.embedding for embedding in response.data], dtype=np.float32)
+
+        async def openai_embed(texts: List[str]) -> np.ndarray:
+            if not texts: return np.empty((0, 0), dtype=np.float32)
             texts = [text.replace("\n", " ") for text in texts]
-            response = client.embeddings.create(model="text-embedding-3-small", input=texts)
-            return [embedding.embedding for embedding in response.data]
-        return openai_embed
+            # Split large inputs into request-sized batches and send them concurrently.
+            batches = [texts[i:i + EMBED_BATCH_SIZE] for i in range(0, len(texts), EMBED_BATCH_SIZE)]
+            results = await asyncio.gather(*[embed_batch(batch) for batch in batches])
+            return np.concatenate(results)
+        return _with_cache(openai_embed, EMBED_MODEL)
 
 # --- LLM Analysis and Generation Services ---
-def strict_json_analyze(chunks: List[Dict[str, Any]], prompt: str, doc_id_for_demo: str = None) -> Dict[str, Any]:
+async def strict_json_analyze(context: str, prompt: str, doc_id_for_demo: str = None) -> Dict[str, Any]:
     if DEMO_MODE:
         return CANNED_ANALYSIS_RESPONSE if doc_id_for_demo == "doc123" else {}
-    context = "\n\n".join([f"--- PAGE {chunk.get('metadata', {}).get('page', 'N/A')} ---\n{chunk['document']}" for chunk in chunks])
+    # Results are memoized by prompt and context, so re-analyzing a document is free.
+    key = cache.llm_key("gpt-4o-mini", prompt, context)
+    cached = await run_in_threadpool(cache.get_llm, key)
+    if cached is not None:
+        return cached
     messages = [{"role": "system", "content": prompt}, {"role": "user", "content": f"Here is the document context:\n{context}"}]
     for attempt in range(2):
         try:
-            response = client.chat.completions.create(model="gpt-4o-mini", messages=messages, temperature=0.2, response_format={"type": "json_object"})
-            return json.loads(response.choices[0].message.content)
-        except (json.JSONDecodeError, OpenAIError) as e:
+            async with SEM_CHAT:
+                response = await client.chat.completions.create(model="gpt-4o-mini", messages=messages, temperature=0.2, response_format={"type": "json_object"})
+            result = orjson.loads(response.choices[0].message.content)
+            await run_in_threadpool(cache.set_llm, key, result)
+            return result
+        except (orjson.JSONDecodeError, OpenAIError) as e:
             if attempt == 0:
                 messages.append({"role": "user", "content": "Your response was not valid JSON. Respond with VALID JSON only."})
             else:
                 raise ValueError("Failed to get valid JSON from LLM after 2 attempts.")
-    raise ValueError("Should not be reachable.")
-
-def generate_markdown_memo(analysis_json: str, prompt: str, language: str) -> str:
-    if DEMO_MODE:
-        return CANNED_MEMO_AR if language == "ar" else CANNED_MEMO_EN
-    final_prompt = prompt.format(analysis_json=analysis_json)
-    messages = [{"role": "system", "content": "You are a professional investment analyst."}, {"role": "user", "content": final_prompt}]
-    try:
-        response = client.chat.completions.create(model="gpt-4o-mini", messages=messages, temperature=0.4)
-        memo_content = response.choices[0].message.content
-        if language == "ar":
-            trans_prompt = f"Translate the following memo into professional Arabic, preserving Markdown:\n\n{memo_content}"
-            trans_messages = [{"role": "system", "content": "You are a financial translator."}, {"role": "user", "content": trans_prompt}]
-            trans_response = client.chat.completions.create(model="gpt-4o-mini", messages=trans_messages, temperature=0.7)
-            return trans_response.choices[0].message.content
-        return memo_content
-    except OpenAIError as e:
-        raise HTTPException(status_code=500, detail=f"Failed to generate memo: {e}")
\ No newline at end of file
+    raise ValueError("Should not be reachable.")
\ No newline at end of file
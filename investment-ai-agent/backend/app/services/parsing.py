@@ -1,27 +1,109 @@
 #
-# parsing.py: Handles text extraction from different file formats and text chunking.
+# parsing.py: Handles text extraction from different file formats, text chunking
+# and near-duplicate chunk detection.
 #
 import io
-import pandas as pd
-import PyPDF2
+import re
+import hashlib
+import threading
+import openpyxl
+import pypdfium2 as pdfium
 import docx
-from typing import List, Dict, Any # <--- FIX: Added 'Any' here
+import numpy as np
+from typing import List, Dict, Set, Any
+
+_WORD_PATTERN = re.compile(r"\S+")
+_PDFIUM_LOCK = threading.Lock()
 
 def chunk_text(text: str, chunk_size: int = 1000) -> List[str]:
     """
     Splits a large block of text into smaller chunks of a specified token size (approximated by words).
+    Chunks are sliced from the original text by word offsets, so no per-word strings are built.
     """
     words_per_chunk = int(chunk_size * 0.75)
-    words = text.split()
-    return [" ".join(words[i:i + words_per_chunk]) for i in range(0, len(words), words_per_chunk)]
+    chunks = []
+    start = end = 0
+    for i, match in enumerate(_WORD_PATTERN.finditer(text)):
+        if i % words_per_chunk == 0:
+            if i:
+                chunks.append(text[start:end])
+            start = match.start()
+        end = match.end()
+    if end > start:
+        chunks.append(text[start:end])
+    return chunks
+
+# --- Near-Duplicate Detection ---
+# Headers, footers and boilerplate repeated across pages produce chunks that are
+# (nearly) identical. Each chunk gets a 64-bit SimHash of its set of word 3-gram
+# shingles, and a chunk within SIMHASH_MAX_DISTANCE bits of an earlier one is
+# dropped before embedding. Shingles are deduplicated and unweighted, so frequent
+# words cannot dominate the fingerprint and unrelated chunks stay far apart.
+SIMHASH_MAX_DISTANCE = 3
+SHINGLE_SIZE = 3
+# Pigeonhole: fingerprints within 3 bits agree exactly on at least one of 4 16-bit
+# bands, so only fingerprints sharing a band with the new one need comparing.
+_SIMHASH_BANDS = SIMHASH_MAX_DISTANCE + 1
+_SIMHASH_BAND_BITS = 64 // _SIMHASH_BANDS
+
+def _shingles(text: str) -> Set[str]:
+    """Returns the distinct lowercased word SHINGLE_SIZE-grams of a text (the whole text if shorter)."""
+    words = _WORD_PATTERN.findall(text.lower())
+    if len(words) <= SHINGLE_SIZE:
+        return {" ".join(words)} if words else set()
+    return {" ".join(words[i:i + SHINGLE_SIZE]) for i in range(len(words) - SHINGLE_SIZE + 1)}
+
+def simhash(text: str) -> int:
+    """Returns the 64-bit SimHash fingerprint of a text's set of word shingles."""
+    shingles = _shingles(text)
+    if not shingles:
+        return 0
+    digests = b"".join(hashlib.blake2b(shingle.encode('utf-8'), digest_size=8).digest() for shingle in shingles)
+    bits = np.unpackbits(np.frombuffer(digests, dtype=np.uint8)).reshape(len(shingles), 64)
+    fingerprint = np.packbits(bits.sum(axis=0) * 2 > len(shingles))
+    return int.from_bytes(fingerprint.tobytes(), "big")
+
+def unique_chunk_indices(chunks: List[str]) -> List[int]:
+    """
+    Returns the indices of the chunks to keep, in order, skipping any chunk whose
+    fingerprint is within SIMHASH_MAX_DISTANCE bits of an earlier kept chunk.
+    """
+    band_mask = (1 << _SIMHASH_BAND_BITS) - 1
+    buckets: List[Dict[int, List[int]]] = [{} for _ in range(_SIMHASH_BANDS)]
+    keep = []
+    for i, chunk in enumerate(chunks):
+        fingerprint = simhash(chunk)
+        bands = [(fingerprint >> (band * _SIMHASH_BAND_BITS)) & band_mask for band in range(_SIMHASH_BANDS)]
+        if any(
+            bin(fingerprint ^ seen).count("1") <= SIMHASH_MAX_DISTANCE
+            for band, key in enumerate(bands)
+            for seen in buckets[band].get(key, ())
+        ):
+            continue
+        for band, key in enumerate(bands):
+            buckets[band].setdefault(key, []).append(fingerprint)
+        keep.append(i)
+    return keep
 
 def extract_text_from_pdf(file_stream: io.BytesIO) -> List[Dict[str, Any]]: # Used 'Any'
-    """Extracts text and page numbers from a PDF file stream."""
-    reader = PyPDF2.PdfReader(file_stream)
-    return [
-        {"page": i + 1, "text": page.extract_text() or ""}
-        for i, page in enumerate(reader.pages)
-    ]
+    """
+    Extracts text and page numbers from a PDF file stream with PDFium's native text extraction.
+    PDFium is not thread-safe, so pages are read one after another and documents
+    parsed from worker threads are serialized on _PDFIUM_LOCK.
+    """
+    with _PDFIUM_LOCK:
+        pdf = pdfium.PdfDocument(file_stream)
+        try:
+            pages_data = []
+            for i in range(len(pdf)):
+                page = pdf[i]
+                textpage = page.get_textpage()
+                pages_data.append({"page": i + 1, "text": textpage.get_text_range()})
+                textpage.close()
+                page.close()
+            return pages_data
+        finally:
+            pdf.close()
 
 def extract_text_from_docx(file_stream: io.BytesIO) -> List[Dict[str, Any]]: # Used 'Any'
     """Extracts text from a DOCX file stream."""
@@ -30,11 +112,21 @@ def extract_text_from_docx(file_stream: io.BytesIO) -> List[Dict[str, Any]]: # U
     return [{"page": 1, "text": full_text}]
 
 def extract_text_from_xlsx(file_stream: io.BytesIO) -> List[Dict[str, Any]]: # Used 'Any'
-    """Extracts text from all sheets of an XLSX file stream."""
-    xls = pd.ExcelFile(file_stream)
-    all_text = []
-    for sheet_name in xls.sheet_names:
-        df = pd.read_excel(xls, sheet_name=sheet_name, header=None)
-        sheet_text = df.to_string(index=False, header=False) if not df.empty else ""
-        all_text.append(f"--- Sheet: {sheet_name} ---\n{sheet_text}")
-    return [{"page": 1, "text": "\n\n".join(all_text)}]
\ No newline at end of file
+    """
+    Extracts text from all sheets of an XLSX file stream. Rows are streamed from a
+    read-only workbook as tab-separated lines, without building DataFrames.
+    """
+    workbook = openpyxl.load_workbook(file_stream, read_only=True, data_only=True)
+    buffer = io.StringIO()
+    try:
+        for i, worksheet in enumerate(workbook.worksheets):
+            if i:
+                buffer.write("\n\n")
+            buffer.write(f"--- Sheet: {worksheet.title} ---\n")
+            for row in worksheet.iter_rows(values_only=True):
+                # Trailing empty cells of the sheet's used range are dropped
+                buffer.write("\t".join("" if cell is None else str(cell) for cell in row).rstrip("\t"))
+                buffer.write("\n")
+    finally:
+        workbook.close()
+    return [{"page": 1, "text": buffer.getvalue()}]
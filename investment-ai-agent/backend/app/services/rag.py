@@ -3,10 +3,23 @@
 # - Manages all interactions with the ChromaDB vector store.
 # - Initializes and connects to the persistent ChromaDB client.
 # - Provides functions to upsert data and query for relevant chunks.
+# - Persists each document's embedding matrix at upload time for similarity search,
+#   plus a FAISS HNSW index when FAISS is installed (served from the GPU when available).
 #
 import os
+import json
 import chromadb
-from typing import List, Callable, Dict, Any
+import numpy as np
+from cachetools import LRUCache
+from fastapi.concurrency import run_in_threadpool
+from typing import List, Callable, Dict, Any, Optional, Tuple
+
+# FAISS is optional. When it is installed, similarity search goes through an HNSW
+# index; otherwise it falls back to a brute-force NumPy matrix product.
+try:
+    import faiss
+except ImportError:
+    faiss = None
 
 # --- ChromaDB Client Initialization ---
 # Reads the directory path from environment variables for configuration.
@@ -22,7 +35,260 @@ def get_collection(name: str):
     """
     return client.get_or_create_collection(name=name)
 
-def upsert_chunks(collection_name: str, chunks: List[str], metadatas: List[Dict], ids: List[str], embed_func: Callable):
+def get_document_info(name: str) -> Optional[Dict[str, Any]]:
+    """
+    Returns the upload summary (filename, pages, chunks) stored on a document's
+    collection, or None if the document was never fully ingested.
+    """
+    try:
+        metadata = client.get_collection(name=name).metadata
+    except Exception:
+        return None
+    return dict(metadata) if metadata and "chunks" in metadata else None
+
+def set_document_info(name: str, info: Dict[str, Any]):
+    """
+    Stores a document's upload summary as its collection metadata, marking it as ingested.
+    """
+    get_collection(name).modify(metadata=info)
+
+# --- Persisted Embeddings ---
+# Embeddings are a one-time cost paid at upload. Next to the ChromaDB data each
+# collection then gets:
+#   <collection>.ids.json    chunk ids, one per matrix row
+#   <collection>.codes.npy   int8 (N, dim) codes of the L2-normalized embeddings
+#   <collection>.scales.npy  float32 (N,) per-row scales: embeddings ~= codes * scales[:, None]
+#   <collection>.faiss       8-bit quantized HNSW index over the same rows (FAISS only)
+# The codes are memory-mapped and int8 storage is a quarter of the float32 footprint
+# on disk and in the page cache. NumPy has no int8 BLAS kernel, so a query casts the
+# codes to float32 for its matrix-vector product; this is done in blocks of
+# SEARCH_BLOCK_ROWS rows so the temporary stays bounded instead of being 4x the matrix.
+# Loaded matrices are kept in a bounded LRU cache per worker.
+_EMBEDDING_MATRICES: LRUCache = LRUCache(maxsize=256)
+SEARCH_BLOCK_ROWS = 4096
+
+def _store_paths(collection_name: str) -> Dict[str, str]:
+    base = os.path.join(CHROMA_DIR, collection_name)
+    return {
+        "ids": f"{base}.ids.json",
+        "codes": f"{base}.codes.npy",
+        "scales": f"{base}.scales.npy",
+        "faiss": f"{base}.faiss",
+    }
+
+def _normalize(embeddings: np.ndarray) -> np.ndarray:
+    """
+    Returns an L2-normalized float32 copy of an (N, dim) embedding matrix.
+    """
+    matrix = np.array(embeddings, dtype=np.float32, order="C")
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    matrix /= norms
+    return matrix
+
+def _fetch_embeddings(collection_name: str) -> Tuple[List[str], np.ndarray]:
+    """
+    Reads a collection's embeddings from ChromaDB as an L2-normalized float32 (N, dim) matrix.
+    """
+    results = get_collection(collection_name).get(include=["embeddings"])
+    ids = results.get("ids", [])
+    if not ids:
+        return [], np.empty((0, 0), dtype=np.float32)
+    return ids, _normalize(results["embeddings"])
+
+def _quantize_int8(matrix: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Symmetric per-row int8 quantization. Returns (codes, scales) with matrix ~= codes * scales[:, None].
+    """
+    max_abs = np.abs(matrix).max(axis=1, initial=0.0)
+    max_abs[max_abs == 0] = 1.0
+    scales = (max_abs / 127.0).astype(np.float32)
+    codes = np.clip(np.rint(matrix / scales[:, None]), -127, 127).astype(np.int8)
+    return codes, scales
+
+def _read_embedding_matrix(collection_name: str) -> Optional[Tuple[List[str], np.ndarray, np.ndarray]]:
+    """
+    Reads a collection's persisted (ids, codes, scales) triple with the codes
+    memory-mapped, or returns None if it was never persisted.
+    """
+    paths = _store_paths(collection_name)
+    if not all(os.path.exists(paths[key]) for key in ("ids", "codes", "scales")):
+        return None
+    with open(paths["ids"]) as f:
+        ids = json.load(f)
+    return ids, np.load(paths["codes"], mmap_mode="r"), np.load(paths["scales"])
+
+def _load_embedding_matrix(collection_name: str) -> Tuple[List[str], np.ndarray, np.ndarray]:
+    """
+    Returns the (ids, codes, scales) triple for a collection, memory-mapping the
+    persisted matrix on first use.
+    """
+    cached = _EMBEDDING_MATRICES.get(collection_name)
+    if cached is None:
+        cached = _read_embedding_matrix(collection_name)
+        if cached is None:
+            # Collections stored before embeddings were persisted are rebuilt from ChromaDB.
+            ids, matrix = _fetch_embeddings(collection_name)
+            cached = (ids, *_quantize_int8(matrix))
+        _EMBEDDING_MATRICES[collection_name] = cached
+    return cached
+
+# --- FAISS HNSW Index ---
+# Vectors inside the HNSW graph are stored with 8-bit scalar quantization.
+HNSW_M = 32
+# Each cached index holds a full copy of its vectors, so fewer are kept than matrices.
+_FAISS_INDEXES: LRUCache = LRUCache(maxsize=32)
+
+# On GPU builds of FAISS the search index is served from the first GPU instead.
+USE_GPU = faiss is not None and hasattr(faiss, "StandardGpuResources") and faiss.get_num_gpus() > 0
+_GPU_RESOURCES = None
+
+def _to_gpu_index(matrix: np.ndarray) -> Any:
+    """
+    Copies normalized embeddings into a GPU inner-product index. HNSW graphs cannot be
+    cloned to the GPU, so this is an exact flat search over float16 vectors, routed
+    through cuVS when FAISS was built with it.
+    """
+    global _GPU_RESOURCES
+    if _GPU_RESOURCES is None:
+        _GPU_RESOURCES = faiss.StandardGpuResources()
+    cpu_index = faiss.IndexFlatIP(matrix.shape[1])
+    cpu_index.add(matrix)
+    options = faiss.GpuClonerOptions()
+    options.useFloat16 = True
+    if hasattr(options, "use_cuvs"):
+        options.use_cuvs = True
+    return faiss.index_cpu_to_gpu(_GPU_RESOURCES, 0, cpu_index, options)
+
+def _build_faiss_index(matrix: np.ndarray) -> Any:
+    """
+    Builds an 8-bit quantized inner-product HNSW index over normalized embeddings.
+    """
+    index = faiss.IndexHNSWSQ(matrix.shape[1], faiss.ScalarQuantizer.QT_8bit, HNSW_M, faiss.METRIC_INNER_PRODUCT)
+    index.train(matrix)
+    index.add(matrix)
+    return index
+
+def _load_faiss_index(collection_name: str) -> Optional[Tuple[List[str], Any]]:
+    """
+    Returns the (ids, index) pair for a collection, or None if FAISS or the index file is unavailable.
+    """
+    if faiss is None:
+        return None
+    cached = _FAISS_INDEXES.get(collection_name)
+    if cached is None and USE_GPU:
+        ids, matrix = _fetch_embeddings(collection_name)
+        if not ids:
+            return None
+        cached = (ids, _to_gpu_index(matrix))
+        _FAISS_INDEXES[collection_name] = cached
+    elif cached is None:
+        paths = _store_paths(collection_name)
+        if not (os.path.exists(paths["faiss"]) and os.path.exists(paths["ids"])):
+            return None
+        with open(paths["ids"]) as f:
+            ids = json.load(f)
+        cached = (ids, faiss.read_index(paths["faiss"]))
+        _FAISS_INDEXES[collection_name] = cached
+    return cached
+
+def _persist_embeddings(collection_name: str, ids: List[str], embeddings: np.ndarray) -> Optional[Any]:
+    """
+    Writes a collection's chunk ids, quantized embedding matrix and (with FAISS)
+    HNSW index to disk from the embeddings just upserted. Returns the search index
+    to serve, or None without FAISS. Runs in a worker thread.
+    """
+    paths = _store_paths(collection_name)
+    matrix = _normalize(embeddings)
+    codes, scales = _quantize_int8(matrix)
+    np.save(paths["codes"], codes)
+    np.save(paths["scales"], scales)
+    with open(paths["ids"], "w") as f:
+        json.dump(ids, f)
+
+    if faiss is None:
+        return None
+    index = _build_faiss_index(matrix)
+    faiss.write_index(index, paths["faiss"])
+    return _to_gpu_index(matrix) if USE_GPU else index
+
+def _search(collection_name: str, query_embedding: np.ndarray, k: int) -> List[str]:
+    """
+    Returns the ids of the k chunks most similar to a normalized query embedding, best first.
+    """
+    faiss_index = _load_faiss_index(collection_name)
+    if faiss_index is not None:
+        ids, index = faiss_index
+        _, top = index.search(query_embedding.reshape(1, -1), min(k, len(ids)))
+        return [ids[i] for i in top[0] if i >= 0]
+
+    ids, codes, scales = _load_embedding_matrix(collection_name)
+    if not ids:
+        return []
+    query_embedding = query_embedding.astype(np.float32, copy=False)
+    scores = np.empty(len(ids), dtype=np.float32)
+    for start in range(0, len(ids), SEARCH_BLOCK_ROWS):
+        end = start + SEARCH_BLOCK_ROWS
+        scores[start:end] = codes[start:end].astype(np.float32) @ query_embedding
+    scores *= scales
+
+    # Select the k best scores without a full sort, then order just those.
+    k = min(k, len(ids))
+    top = np.argpartition(-scores, k - 1)[:k]
+    top = top[np.argsort(-scores[top])]
+    return [ids[i] for i in top]
+
+# --- Retrieved Chunks ---
+# Retrieval results are returned column-wise (structure of arrays) rather than as
+# one dict per chunk: {"ids": [...], "texts": [...], "pages": int32 ndarray}.
+def _to_columns(ids: List[str], documents: List[str], metadatas: List[Dict]) -> Dict[str, Any]:
+    return {
+        "ids": list(ids),
+        "texts": list(documents),
+        "pages": np.fromiter((meta.get("page", 0) for meta in metadatas), dtype=np.int32, count=len(metadatas)),
+    }
+
+# --- Analysis Context Cache ---
+# The page-headed context string handed to the LLM only depends on which chunks
+# were retrieved, so it is built once per (collection, chunk ids) and reused.
+_CONTEXT_CACHE: LRUCache = LRUCache(maxsize=1024)
+
+def build_context(collection_name: str, chunks: Dict[str, Any]) -> str:
+    """
+    Joins retrieved chunks into one LLM context string with a page header per chunk.
+    """
+    key = (collection_name, tuple(chunks["ids"]))
+    context = _CONTEXT_CACHE.get(key)
+    if context is None:
+        context = "\n\n".join(
+            f"--- PAGE {page} ---\n{text}" for page, text in zip(chunks["pages"].tolist(), chunks["texts"])
+        )
+        _CONTEXT_CACHE[key] = context
+    return context
+
+# Maximum number of chunks written to ChromaDB in one upsert call.
+UPSERT_BATCH_SIZE = 5000
+
+def _write_chunks(collection_name: str, chunks: List[str], metadatas: List[Dict], ids: List[str], embeddings: np.ndarray) -> Optional[Any]:
+    """
+    Upserts embedded chunks into ChromaDB and persists their embeddings for search.
+    Returns the FAISS index built over them, if any.
+    """
+    # Large documents are written in bounded batches to cap ChromaDB's per-call transaction size.
+    collection = get_collection(collection_name)
+    for start in range(0, len(chunks), UPSERT_BATCH_SIZE):
+        end = start + UPSERT_BATCH_SIZE
+        collection.upsert(
+            documents=chunks[start:end],
+            embeddings=embeddings[start:end],
+            metadatas=metadatas[start:end],
+            ids=ids[start:end]
+        )
+    # Collections are written once under content-hash ids, so the embeddings in
+    # hand are the collection's full contents and need not be read back.
+    return _persist_embeddings(collection_name, ids, embeddings)
+
+async def upsert_chunks(collection_name: str, chunks: List[str], metadatas: List[Dict], ids: List[str], embed_func: Callable):
     """
     Generates embeddings for text chunks and upserts them into a ChromaDB collection.
     'Upsert' will add new documents or update existing ones based on their unique ID.
@@ -34,46 +300,57 @@ def upsert_chunks(collection_name: str, chunks: List[str], metadatas: List[Dict]
     # The embedding function is passed in from the caller (e.g., upload router).
     # This decouples the RAG service from the specific embedding model,
     # allowing it to work with either the real OpenAI embedder or the offline hash-based one.
-    embeddings = embed_func(chunks)
-    
-    collection = get_collection(collection_name)
-    collection.upsert(
-        documents=chunks,
-        embeddings=embeddings,
-        metadatas=metadatas,
-        ids=ids
-    )
+    # The float32 matrix is passed to ChromaDB directly, without a list round-trip.
+    embeddings = np.asarray(await embed_func(chunks), dtype=np.float32)
+
+    # Writing to ChromaDB, quantizing and building the index are blocking, so they
+    # run in a worker thread instead of stalling the event loop for the whole ingest.
+    index = await run_in_threadpool(_write_chunks, collection_name, chunks, metadatas, ids, embeddings)
 
-def get_top_k(collection_name: str, query_text: str, k: int, embed_func: Callable) -> List[Dict[str, Any]]:
+    # The collection changed, so its cached contexts are stale; the embedding
+    # matrix and index were rewritten once above so queries never re-embed chunks.
+    for key in [key for key in _CONTEXT_CACHE if key[0] == collection_name]:
+        _CONTEXT_CACHE.pop(key, None)
+    _FAISS_INDEXES.pop(collection_name, None)
+    if index is not None:
+        _FAISS_INDEXES[collection_name] = (ids, index)
+    _EMBEDDING_MATRICES[collection_name] = _read_embedding_matrix(collection_name)
+
+def _get_chunks(collection_name: str, **kwargs) -> Dict[str, Any]:
+    """
+    Reads chunk texts and metadata from a collection; keyword arguments go to ChromaDB's .get().
+    """
+    return get_collection(collection_name).get(include=["metadatas", "documents"], **kwargs)
+
+async def get_top_k(collection_name: str, query_text: str, k: int, embed_func: Callable) -> Dict[str, Any]:
     """
     Retrieves the top-k most relevant chunks from a specific document collection.
     This is the core "retrieval" step in RAG.
+    Returns parallel "ids", "texts" and "pages" columns, best match first.
+    ChromaDB reads block, so they run in a worker thread.
     """
-    collection = get_collection(collection_name)
-    
     # MVP Requirement: If the query_text is empty (as it is for the initial analysis),
     # we don't perform a similarity search. Instead, we return the first 'k' chunks
     # from the document to provide a general, high-level context for the LLM.
     if not query_text:
-        results = collection.get(limit=k, include=["metadatas", "documents"])
-        # The output of .get() is a dictionary of lists. We need to reformat it to
-        # match the structure of the .query() method's output for consistency.
-        return [
-            {"document": doc, "metadata": meta}
-            for doc, meta in zip(results.get("documents", []), results.get("metadatas", []))
-        ]
-
-    # If a specific query is provided, generate an embedding for it and perform a similarity search.
-    query_embedding = embed_func([query_text])[0]
-    results = collection.query(
-        query_embeddings=[query_embedding],
-        n_results=k,
-        include=["metadatas", "documents"]
-    )
-    
-    # The result from .query() is a dictionary containing lists of lists (one for each query).
-    # Since we only have one query, we access the first element of each list.
-    docs = results.get("documents", [[]])[0]
-    metas = results.get("metadatas", [[]])[0]
-
-    return [{"document": doc, "metadata": meta} for doc, meta in zip(docs, metas)]
\ No newline at end of file
+        results = await run_in_threadpool(_get_chunks, collection_name, limit=k)
+        # The output of .get() is already a dictionary of parallel lists.
+        return _to_columns(results.get("ids", []), results.get("documents", []), results.get("metadatas", []))
+
+    # If a specific query is provided, embed it and search the collection's embeddings.
+    query_embedding = (await embed_func([query_text]))[0]
+    norm = np.linalg.norm(query_embedding)
+    if norm > 0:
+        query_embedding = query_embedding / norm
+    top_ids = _search(collection_name, query_embedding, k)
+    if not top_ids:
+        return _to_columns([], [], [])
+
+    # ChromaDB does not guarantee result order for .get(ids=...), so re-order by id.
+    results = await run_in_threadpool(_get_chunks, collection_name, ids=top_ids)
+    position = {chunk_id: i for i, chunk_id in enumerate(results.get("ids", []))}
+    order = [position[chunk_id] for chunk_id in top_ids if chunk_id in position]
+    documents, metadatas = results.get("documents", []), results.get("metadatas", [])
+    return _to_columns(
+        [results["ids"][i] for i in order], [documents[i] for i in order], [metadatas[i] for i in order]
+    )
\ No newline at end of file
@@ -3,7 +3,7 @@
 # - Determines a compliance status (Pass, Review, Fail).
 
 import re
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Set
 
 # Use word boundaries to reduce false positives.
 INTEREST_KEYWORDS = r"\b(interest|riba|conventional bank|loan interest|usury|usurious)\b"
@@ -11,6 +11,36 @@ ALCOHOL_KEYWORDS = r"\b(alcohol|beer|wine|spirits|liquor)\b"
 GAMBLING_KEYWORDS = r"\b(gambling|casino|betting|wager|lottery|bookmaker)\b"
 PROHIBITED_PRODUCTS_KEYWORDS = r"\b(pork|swine|tobacco)\b"
 
+# All categories are compiled into one case-insensitive alternation with a named
+# group per category, so each chunk is scanned in a single pass and without a
+# lowercased copy; the matching category is read from `match.lastgroup`.
+KEYWORD_CATEGORIES = {
+    "interest": INTEREST_KEYWORDS,
+    "alcohol": ALCOHOL_KEYWORDS,
+    "gambling": GAMBLING_KEYWORDS,
+    "prohibited_products": PROHIBITED_PRODUCTS_KEYWORDS,
+}
+_KEYWORD_SCANNER = re.compile(
+    "|".join(f"(?P<{name}>{pattern})" for name, pattern in KEYWORD_CATEGORIES.items()), re.IGNORECASE
+)
+
+# Business-overview terms marking conventional lending as the core business (substring match).
+LENDING_OVERVIEW_TERMS = ("bank", "lending", "loan", "interest-bearing", "conventional finance")
+_LENDING_OVERVIEW = re.compile("|".join(map(re.escape, LENDING_OVERVIEW_TERMS)), re.IGNORECASE)
+
+def _matched_categories(texts: List[str]) -> Set[str]:
+    """
+    Returns the keyword categories present in the chunks, stopping once all have been seen.
+    Chunks are scanned one at a time rather than joined into a single document string.
+    """
+    found: Set[str] = set()
+    for text in texts:
+        for match in _KEYWORD_SCANNER.finditer(text):
+            found.add(match.lastgroup)
+            if len(found) == len(KEYWORD_CATEGORIES):
+                return found
+    return found
+
 def screen_sharia(texts: List[str], analysis: Dict[str, Any]) -> Dict[str, Any]:
     """
     Performs a Sharia compliance screen on document text and analysis results.
@@ -22,24 +52,24 @@ def screen_sharia(texts: List[str], analysis: Dict[str, Any]) -> Dict[str, Any]:
     Returns:
         A dictionary with "status" and a list of "reasons".
     """
-    full_text = " ".join(texts).lower()
+    found = _matched_categories(texts)
     reasons: List[str] = []
 
     # Rule 1: Core business in conventional lending ==> Fail
-    if re.search(INTEREST_KEYWORDS, full_text):
-        overview = (analysis or {}).get("business_overview", "").lower()
-        if any(k in overview for k in ("bank", "lending", "loan", "interest-bearing", "conventional finance")):
+    if "interest" in found:
+        overview = (analysis or {}).get("business_overview", "")
+        if _LENDING_OVERVIEW.search(overview):
             reasons.append("Company's core business appears to be in conventional lending or interest-based finance.")
             return {"status": "Fail", "reasons": reasons}
         else:
             reasons.append("Detected keywords related to interest/riba. Further review of revenue sources is required.")
 
     # Rule 2: Other prohibited lines ==> Review
-    if re.search(ALCOHOL_KEYWORDS, full_text):
+    if "alcohol" in found:
         reasons.append("Detected keywords related to alcohol production or sale.")
-    if re.search(GAMBLING_KEYWORDS, full_text):
+    if "gambling" in found:
         reasons.append("Detected keywords related to gambling or betting activities.")
-    if re.search(PROHIBITED_PRODUCTS_KEYWORDS, full_text):
+    if "prohibited_products" in found:
         reasons.append("Detected keywords related to pork or tobacco products.")
 
     if reasons: